@@ -0,0 +1,381 @@
+#
+# auto_matcher.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import re
+import fnmatch
+import collections
+import urlparse
+
+from deluge.log import LOG as log
+
+from constant import PLUGIN_NAME
+
+
+FIELD_NAME = "name"
+FIELD_TRACKER = "tracker"
+
+HOST_PREFIX = "host:"
+REGEX_PREFIX = "re:"
+GLOB_PREFIX = "glob:"
+
+MAX_CACHED_PATTERNS = 512
+
+# Inline flags apply to the whole expression, so such patterns stand alone
+RE_GLOBAL_FLAGS = re.compile(r"\(\?[iLmsux]+\)")
+
+_pattern_cache = {}
+
+
+def get_tracker_host(url):
+
+  try:
+    host = urlparse.urlsplit(url.strip()).hostname
+  except ValueError:
+    host = None
+
+  return host or ""
+
+
+def get_host_rule(line):
+
+  # "host:example.org" matches trackers on example.org and its subdomains
+
+  line = line.strip()
+  if not line.lower().startswith(HOST_PREFIX):
+    return None
+
+  return line[len(HOST_PREFIX):].strip().strip(".").lower()
+
+
+def get_pattern_rule(line):
+
+  # "re:<regex>" searches for the expression, "glob:<pattern>" has to match
+  # the whole string; both are returned as regular expression source. The
+  # prefixes are case-sensitive and only apply to labels with auto_patterns.
+
+  line = line.strip()
+
+  if line.startswith(REGEX_PREFIX):
+    return line[len(REGEX_PREFIX):].strip()
+  elif line.startswith(GLOB_PREFIX):
+    source = fnmatch.translate(line[len(GLOB_PREFIX):].strip())
+    return "^%s" % RE_GLOBAL_FLAGS.sub("", source)
+
+  return None
+
+
+def compile_pattern(source):
+
+  pattern = _pattern_cache.get(source)
+  if pattern is None:
+    if len(_pattern_cache) >= MAX_CACHED_PATTERNS:
+      _pattern_cache.clear()
+
+    pattern = re.compile(source)
+    _pattern_cache[source] = pattern
+
+  return pattern
+
+
+def combine_patterns(sources):
+
+  # Joins the patterns that can share one alternation; patterns with groups
+  # or inline flags would change meaning when combined, so they stay apart
+
+  patterns = []
+  combined = []
+  for source in sources:
+    pattern = compile_pattern(source)
+    if pattern.groups or RE_GLOBAL_FLAGS.search(source):
+      patterns.append(pattern)
+    else:
+      combined.append(source)
+
+  if len(combined) == 1:
+    patterns.insert(0, compile_pattern(combined[0]))
+  elif combined:
+    patterns.insert(0, compile_pattern(
+        "|".join("(?:%s)" % x for x in combined)))
+
+  return patterns
+
+
+def iter_host_suffixes(host):
+
+  # "a.example.org" yields "a.example.org", "example.org" and "org"
+
+  while host:
+    yield host
+    host = host.partition(".")[2]
+
+
+def match_torrents(args):
+
+  # Process pool worker: takes (matcher, [(torrent_id, name, trackers), ...])
+  # and returns (torrent_id, label_id) for each torrent that matched
+
+  matcher, torrents = args
+
+  results = []
+  for torrent_id, name, trackers in torrents:
+    label_id = matcher.match(name, trackers)
+    if label_id:
+      results.append((torrent_id, label_id))
+
+  return results
+
+
+class AutoMatcher(object):
+
+  # Matches torrents against the auto-label queries of many labels at once.
+  # All query terms go into one Aho-Corasick automaton, so a string is
+  # scanned a single time no matter how many labels there are. A query line
+  # matches once every one of its terms has been seen in the same string.
+  # Tracker host rules bypass the automaton and are looked up by hostname.
+  # Regex and glob rules, where a label enables them, are combined per label
+  # and tried in label order.
+
+
+  def __init__(self, rules):
+
+    self._keys = []
+
+    self._goto = [{}]
+    self._fail = [0]
+    self._out = [set()]
+    self._terms = {}
+
+    self._needed = []
+    self._rule_of = []
+    self._clauses = {FIELD_NAME: {}, FIELD_TRACKER: {}}
+    self._always = {FIELD_NAME: None, FIELD_TRACKER: None}
+    self._hosts = {}
+    self._patterns = {FIELD_NAME: [], FIELD_TRACKER: []}
+
+    for key, field, queries, patterns in rules:
+      order = len(self._keys)
+      self._keys.append(key)
+
+      sources = []
+      for line in queries:
+        source = get_pattern_rule(line) if patterns else None
+        if source is not None:
+          sources.append(source)
+          continue
+
+        host = get_host_rule(line) if field == FIELD_TRACKER else None
+        if host:
+          self._hosts.setdefault(host, order)
+        elif host is None:
+          self._add_clause(order, field, line.split())
+
+      if sources:
+        self._add_patterns(order, field, sources)
+
+    self._build_failure_links()
+
+
+  def __len__(self):
+
+    return len(self._keys)
+
+
+  @property
+  def uses_trackers(self):
+
+    return bool(self._clauses[FIELD_TRACKER] or self._hosts or
+        self._patterns[FIELD_TRACKER] or
+        self._always[FIELD_TRACKER] is not None)
+
+
+  def match(self, name, trackers=()):
+
+    # Returns the key of the earliest rule that matches, or None
+
+    best = self._scan(name, FIELD_NAME, None)
+
+    for tracker in trackers:
+      if self._hosts:
+        best = self._lookup_host(get_tracker_host(tracker), best)
+
+      best = self._scan(tracker, FIELD_TRACKER, best)
+
+    if best is None:
+      return None
+
+    return self._keys[best]
+
+
+  def _add_clause(self, order, field, terms):
+
+    ids = set(self._add_term(t) for t in terms)
+    if not ids:
+      always = self._always[field]
+      if always is None or order < always:
+        self._always[field] = order
+      return
+
+    clause = len(self._needed)
+    self._needed.append(len(ids))
+    self._rule_of.append(order)
+
+    clauses = self._clauses[field]
+    for id in ids:
+      clauses.setdefault(id, []).append(clause)
+
+
+  def _add_patterns(self, order, field, sources):
+
+    try:
+      patterns = combine_patterns(sources)
+    except re.error as e:
+      # Queries are validated when set, this only guards older config data
+      log.debug("[%s] Skipping invalid patterns of %s: %s", PLUGIN_NAME,
+          self._keys[order], e)
+      return
+
+    self._patterns[field].append((order, patterns))
+
+
+  def _add_term(self, term):
+
+    id = self._terms.get(term)
+    if id is not None:
+      return id
+
+    id = len(self._terms)
+    self._terms[term] = id
+
+    state = 0
+    for char in term:
+      next = self._goto[state].get(char)
+      if next is None:
+        next = len(self._goto)
+        self._goto.append({})
+        self._fail.append(0)
+        self._out.append(set())
+        self._goto[state][char] = next
+
+      state = next
+
+    self._out[state].add(id)
+
+    return id
+
+
+  def _build_failure_links(self):
+
+    goto = self._goto
+    fail = self._fail
+    out = self._out
+
+    queue = collections.deque(goto[0].itervalues())
+    while queue:
+      state = queue.popleft()
+
+      for char, next in goto[state].iteritems():
+        queue.append(next)
+
+        f = fail[state]
+        while f and char not in goto[f]:
+          f = fail[f]
+
+        fail[next] = goto[f].get(char, 0)
+        out[next] |= out[fail[next]]
+
+
+  def _search(self, text):
+
+    goto = self._goto
+    fail = self._fail
+    out = self._out
+
+    found = set()
+    state = 0
+    for char in text:
+      while state and char not in goto[state]:
+        state = fail[state]
+
+      state = goto[state].get(char, 0)
+      if out[state]:
+        found |= out[state]
+
+    return found
+
+
+  def _lookup_host(self, host, best):
+
+    hosts = self._hosts
+    for suffix in iter_host_suffixes(host):
+      order = hosts.get(suffix)
+      if order is not None and (best is None or order < best):
+        best = order
+
+    return best
+
+
+  def _scan(self, text, field, best):
+
+    always = self._always[field]
+    if always is not None and (best is None or always < best):
+      best = always
+
+    for order, patterns in self._patterns[field]:
+      if best is not None and order >= best:
+        break
+
+      if any(x.search(text) for x in patterns):
+        best = order
+        break
+
+    clauses = self._clauses[field]
+    if not clauses:
+      return best
+
+    needed = self._needed
+    rule_of = self._rule_of
+
+    hits = {}
+    for id in self._search(text):
+      for clause in clauses.get(id, ()):
+        count = hits.get(clause, 0) + 1
+        hits[clause] = count
+
+        if count == needed[clause]:
+          order = rule_of[clause]
+          if best is None or order < best:
+            best = order
+
+    return best
@@ -38,6 +38,9 @@ MODULE_NAME = "labelplus"
 DISPLAY_NAME = _("Label Plus")
 
 CORE_CONFIG = "%s.conf" % MODULE_NAME
+CORE_MAPPINGS = "%s.mappings" % MODULE_NAME
+CORE_JOURNAL = "%s.journal" % MODULE_NAME
+CORE_DATABASE = "%s.db" % MODULE_NAME
 GTKUI_CONFIG = "%s_ui.conf" % MODULE_NAME
 WEBUI_SCRIPT = "%s.js" % MODULE_NAME
 
@@ -65,6 +68,15 @@ OPTION_DEFAULTS = {
   "include_children": False,
   "show_full_name": False,
   "move_on_changes": False,
+
+  "storage_backend": "config",
+
+  "threaded_save": False,
+  "save_interval": 5.0,
+  "save_threshold": 100,
+  "journal_limit": 1048576,
+
+  "rescan_processes": 1,
 }
 
 LABEL_DEFAULTS = {
@@ -90,4 +102,5 @@ LABEL_DEFAULTS = {
   "auto_name": True,
   "auto_tracker": False,
   "auto_queries": [],
+  "auto_patterns": False,
 }
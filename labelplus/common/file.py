@@ -48,3 +48,18 @@ def get_resource(filename):
 
   return pkg_resources.resource_filename(
       MODULE_NAME, os.path.join("data", filename))
+
+
+def write_atomic(path, data):
+
+  tmp_path = "%s.new" % path
+
+  with open(tmp_path, "wb") as f:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+  if os.name == "nt" and os.path.exists(path):
+    os.remove(path)
+
+  os.rename(tmp_path, path)
@@ -0,0 +1,293 @@
+#
+# job.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import multiprocessing
+
+from twisted.internet import reactor
+from twisted.internet import threads
+
+from deluge.log import LOG as log
+
+from constant import PLUGIN_NAME
+
+
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+
+
+class Job(object):
+
+  # Common state of a background job. Results are (item, result) pairs for
+  # every item that produced a result, handed to the finish callback.
+
+
+  def __init__(self, id, items, finish, info=None):
+
+    self.id = id
+    self.info = info or {}
+    self.state = JOB_RUNNING
+    self.done = 0
+    self.total = len(items)
+    self.results = []
+
+    self._items = items
+    self._finish = finish
+
+
+  @property
+  def running(self):
+
+    return self.state == JOB_RUNNING
+
+
+  def cancel(self):
+
+    if self.state != JOB_RUNNING:
+      return
+
+    self.state = JOB_CANCELLED
+    self.results = []
+
+    log.debug("[%s] Job %s cancelled at %s/%s", PLUGIN_NAME, self.id,
+        self.done, self.total)
+
+
+  def get_status(self):
+
+    status = dict(self.info)
+    status.update({
+      "id": self.id,
+      "state": self.state,
+      "done": self.done,
+      "total": self.total,
+      "matched": len(self.results),
+    })
+
+    return status
+
+
+  def _complete(self):
+
+    try:
+      self._finish(self)
+    except Exception:
+      self.state = JOB_FAILED
+      log.exception("[%s] Job %s failed", PLUGIN_NAME, self.id)
+      return
+
+    self.state = JOB_FINISHED
+    log.debug("[%s] Job %s finished: %s of %s matched", PLUGIN_NAME,
+        self.id, len(self.results), self.total)
+
+
+class ChunkedJob(Job):
+
+  # Runs a function over the items a chunk at a time on the reactor,
+  # returning to it between chunks so a long pass never blocks the daemon
+
+
+  def __init__(self, id, items, process, finish, chunk_size, info=None):
+
+    super(ChunkedJob, self).__init__(id, items, finish, info)
+
+    self._process = process
+    self._chunk_size = chunk_size
+    self._call = None
+
+
+  def start(self):
+
+    self._call = reactor.callLater(0, self._run_chunk)
+
+
+  def cancel(self):
+
+    if self._call and self._call.active():
+      self._call.cancel()
+
+    self._call = None
+
+    super(ChunkedJob, self).cancel()
+
+
+  def _run_chunk(self):
+
+    self._call = None
+    if self.state != JOB_RUNNING:
+      return
+
+    end = min(self.done + self._chunk_size, self.total)
+
+    try:
+      for item in self._items[self.done:end]:
+        result = self._process(item)
+        if result:
+          self.results.append((item, result))
+    except Exception:
+      self.state = JOB_FAILED
+      log.exception("[%s] Job %s failed", PLUGIN_NAME, self.id)
+      return
+
+    self.done = end
+    if self.done < self.total:
+      self._call = reactor.callLater(0, self._run_chunk)
+    else:
+      self._complete()
+
+
+class PoolJob(Job):
+
+  # Runs a picklable function over the items in a pool of worker processes.
+  # Items are first turned into picklable data by the prepare function a
+  # chunk at a time on the reactor; items it returns None for are skipped.
+  # The pool is then driven from a thread and the results are merged back
+  # on the reactor. The function takes (args, data) and returns the result
+  # pairs.
+
+
+  def __init__(self, id, items, prepare, work, args, finish, processes,
+      chunk_size, info=None):
+
+    super(PoolJob, self).__init__(id, items, finish, info)
+
+    self._prepare = prepare
+    self._work = work
+    self._args = args
+    self._processes = processes
+    self._chunk_size = chunk_size
+    self._call = None
+
+    self._prepared = 0
+    self._data = []
+
+
+  def start(self):
+
+    self._call = reactor.callLater(0, self._prepare_chunk)
+
+
+  def cancel(self):
+
+    if self._call and self._call.active():
+      self._call.cancel()
+
+    self._call = None
+
+    super(PoolJob, self).cancel()
+
+
+  def _prepare_chunk(self):
+
+    self._call = None
+    if self.state != JOB_RUNNING:
+      return
+
+    end = min(self._prepared + self._chunk_size, self.total)
+
+    try:
+      for item in self._items[self._prepared:end]:
+        data = self._prepare(item)
+        if data is not None:
+          self._data.append(data)
+    except Exception:
+      self.state = JOB_FAILED
+      log.exception("[%s] Job %s failed", PLUGIN_NAME, self.id)
+      return
+
+    self._prepared = end
+    if self._prepared < self.total:
+      self._call = reactor.callLater(0, self._prepare_chunk)
+    else:
+      deferred = threads.deferToThread(self._run_pool, self._data)
+      deferred.addCallbacks(self._on_pool_done, self._on_pool_failed)
+
+      self._data = []
+
+
+  def _run_pool(self, data):
+
+    # Several chunks per process so progress can be reported
+    size = max(1, -(-len(data) // (self._processes*4)))
+    chunks = [(self._args, data[i:i+size])
+        for i in xrange(0, len(data), size)]
+
+    try:
+      pool = multiprocessing.Pool(self._processes)
+    except (OSError, ImportError) as e:
+      log.debug("[%s] Job %s running without a process pool: %s",
+          PLUGIN_NAME, self.id, e)
+      pool = None
+
+    results = []
+    try:
+      if pool:
+        chunk_results = pool.imap_unordered(self._work, chunks)
+      else:
+        chunk_results = (self._work(x) for x in chunks)
+
+      for result in chunk_results:
+        if self.state != JOB_RUNNING:
+          break
+
+        results.extend(result)
+        self.done = min(self.total, self.done + size)
+    finally:
+      if pool:
+        pool.terminate()
+        pool.join()
+
+    return results
+
+
+  def _on_pool_done(self, results):
+
+    if self.state != JOB_RUNNING:
+      return
+
+    self.done = self.total
+    self.results = results
+    self._complete()
+
+
+  def _on_pool_failed(self, failure):
+
+    if self.state != JOB_RUNNING:
+      return
+
+    self.state = JOB_FAILED
+    log.error("[%s] Job %s failed: %s", PLUGIN_NAME, self.id,
+        failure.getErrorMessage())
@@ -0,0 +1,166 @@
+#
+# journal.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import json
+import shutil
+
+from deluge.log import LOG as log
+
+from constant import PLUGIN_NAME
+
+
+class MappingJournal(object):
+
+
+  def __init__(self, path):
+
+    self.path = path
+    self.rotated_path = "%s.old" % path
+    self.size = 0
+
+    self._file = None
+
+
+  def replay(self, mappings):
+
+    count = 0
+    for path in (self.rotated_path, self.path):
+      if os.path.exists(path):
+        count += self._replay_file(path, mappings)
+
+    return count
+
+
+  def _replay_file(self, path, mappings):
+
+    count = 0
+    with open(path, "rb") as f:
+      for line in f:
+        try:
+          torrent_id, label_id = json.loads(line)
+        except ValueError:
+          # Partially written record from an interrupted append
+          log.debug("[%s] Skipping bad journal record: %r", PLUGIN_NAME,
+              line)
+          continue
+
+        if label_id:
+          mappings[torrent_id] = label_id
+        elif torrent_id in mappings:
+          del mappings[torrent_id]
+
+        count += 1
+
+    return count
+
+
+  def open(self):
+
+    self._file = open(self.path, "ab")
+    self._file.seek(0, os.SEEK_END)
+    self.size = self._file.tell()
+
+
+  def append(self, torrent_id, label_id):
+
+    record = "%s\n" % json.dumps((torrent_id, label_id or None))
+
+    self._file.write(record)
+    self._file.flush()
+
+    self.size += len(record)
+
+
+  def extend(self, records):
+
+    data = "".join("%s\n" % json.dumps((torrent_id, label_id or None))
+        for torrent_id, label_id in records)
+
+    self._file.write(data)
+    self._file.flush()
+
+    self.size += len(data)
+
+
+  def rotate(self):
+
+    # Records move to the rotated segment, which is kept until a snapshot
+    # that includes them has been written
+    self._file.close()
+
+    if os.path.exists(self.rotated_path):
+      with open(self.rotated_path, "ab") as dst, open(self.path, "rb") as src:
+        shutil.copyfileobj(src, dst)
+
+      os.remove(self.path)
+    else:
+      os.rename(self.path, self.rotated_path)
+
+    self._file = open(self.path, "wb")
+    self.size = 0
+
+
+  def discard_rotated(self):
+
+    if os.path.exists(self.rotated_path):
+      os.remove(self.rotated_path)
+
+
+  def truncate(self):
+
+    if self._file:
+      self._file.close()
+
+    self._file = open(self.path, "wb")
+    self.size = 0
+
+    self.discard_rotated()
+
+
+  def remove(self):
+
+    self.close()
+
+    for path in (self.rotated_path, self.path):
+      if os.path.exists(path):
+        os.remove(path)
+
+
+  def close(self):
+
+    if self._file:
+      self._file.close()
+      self._file = None
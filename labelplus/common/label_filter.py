@@ -0,0 +1,151 @@
+#
+# label_filter.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import re
+
+from validation import require
+
+
+# Operators in order of increasing precedence: "|" (or), "&" (and), "!" (not)
+RE_TOKEN = re.compile(r"\s*(?:([()&|!])|([^\s()&|!]+))")
+RE_OPERATOR = re.compile(r"[\s()&|!]")
+
+
+def is_expression(value):
+
+  return RE_OPERATOR.search(value) is not None
+
+
+def parse_filter(expression):
+
+  # Returns a tree of ("id", label_id), ("not", node), ("and", left, right)
+  # and ("or", left, right) tuples
+
+  tokens = []
+  pos = 0
+  expression = expression.strip()
+  while pos < len(expression):
+    match = RE_TOKEN.match(expression, pos)
+    require(match, "Invalid filter expression: %s" % expression)
+
+    tokens.append(match.group(1) or ("id", match.group(2)))
+    pos = match.end()
+
+  parser = _Parser(tokens, expression)
+  node = parser.parse_or()
+  require(parser.pos == len(tokens), "Invalid filter expression: %s" %
+      expression)
+
+  return node
+
+
+def evaluate_filter(node, resolve, universe):
+
+  # Set algebra over the tree; resolve(label_id) gives the set for an id and
+  # universe() all torrents, used for negation. Neither set is modified.
+
+  kind = node[0]
+  if kind == "id":
+    return resolve(node[1])
+  elif kind == "not":
+    return universe() - evaluate_filter(node[1], resolve, universe)
+
+  left = evaluate_filter(node[1], resolve, universe)
+  if kind == "and":
+    if not left:
+      return left
+
+    return left & evaluate_filter(node[2], resolve, universe)
+  else:
+    return left | evaluate_filter(node[2], resolve, universe)
+
+
+class _Parser(object):
+
+
+  def __init__(self, tokens, expression):
+
+    self.tokens = tokens
+    self.expression = expression
+    self.pos = 0
+
+
+  def parse_or(self):
+
+    node = self.parse_and()
+    while self._accept("|"):
+      node = ("or", node, self.parse_and())
+
+    return node
+
+
+  def parse_and(self):
+
+    node = self.parse_not()
+    while self._accept("&"):
+      node = ("and", node, self.parse_not())
+
+    return node
+
+
+  def parse_not(self):
+
+    if self._accept("!"):
+      return ("not", self.parse_not())
+
+    if self._accept("("):
+      node = self.parse_or()
+      require(self._accept(")"), "Unbalanced parentheses in filter: %s" %
+          self.expression)
+
+      return node
+
+    require(self.pos < len(self.tokens) and
+        isinstance(self.tokens[self.pos], tuple),
+        "Invalid filter expression: %s" % self.expression)
+
+    node = self.tokens[self.pos]
+    self.pos += 1
+
+    return node
+
+
+  def _accept(self, token):
+
+    if self.pos < len(self.tokens) and self.tokens[self.pos] == token:
+      self.pos += 1
+      return True
+
+    return False
@@ -0,0 +1,291 @@
+#
+# label_index.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+from constant import NULL_PARENT
+
+import label as Label
+
+
+class LabelIndex(object):
+
+  # Tracks each label's children and torrents in sets, along with subtree
+  # torrent counts. Subtree torrent sets are built on demand.
+  #
+  # Labels are also numbered in pre-order, so each subtree is a contiguous
+  # range of the order list: a label is under another when its number falls
+  # between the other's pre and post numbers. Numbering is redone lazily
+  # after labels are added or removed.
+
+
+  def __init__(self):
+
+    self._children = {}
+    self._parents = {}
+    self._torrents = {}
+    self._subtree_counts = {}
+    self._subtree_torrents = {}
+
+    self._order = None
+    self._pre = {}
+    self._post = {}
+
+    self._changed = set()
+
+
+  def __contains__(self, label_id):
+
+    return label_id in self._torrents
+
+
+  def __iter__(self):
+
+    return iter(self._torrents)
+
+
+  def __len__(self):
+
+    return len(self._torrents)
+
+
+  @classmethod
+  def build(cls, label_ids, mappings):
+
+    index = cls()
+    for id in label_ids:
+      index._children[id] = set()
+      index._torrents[id] = set()
+      index._parents[id] = Label.get_parent(id)
+
+    for id in label_ids:
+      if id == NULL_PARENT: continue
+
+      children = index._children.get(index._parents[id])
+      if children is not None:
+        children.add(id)
+
+    for torrent_id, label_id in mappings.iteritems():
+      index._torrents[label_id].add(torrent_id)
+
+    # Reverse pre-order totals children before their parents
+    counts = index._subtree_counts
+    for id in reversed(index._get_order()):
+      counts[id] = counts.get(id, 0) + len(index._torrents[id])
+
+      parent_id = index._parents[id]
+      if parent_id in index._torrents:
+        counts[parent_id] = counts.get(parent_id, 0) + counts[id]
+
+    index._changed.update(label_ids)
+
+    return index
+
+
+  def add_label(self, label_id):
+
+    parent_id = Label.get_parent(label_id)
+
+    self._children[label_id] = set()
+    self._parents[label_id] = parent_id
+    self._torrents[label_id] = set()
+    self._subtree_counts[label_id] = 0
+
+    if parent_id in self._children:
+      self._children[parent_id].add(label_id)
+
+    self._order = None
+    self._changed.add(label_id)
+
+
+  def remove_label(self, label_id):
+
+    parent_id = self._parents.pop(label_id)
+    if parent_id in self._children:
+      self._children[parent_id].discard(label_id)
+
+    self._adjust_counts(parent_id, -self._subtree_counts[label_id])
+
+    self._order = None
+
+    del self._children[label_id]
+    del self._torrents[label_id]
+    del self._subtree_counts[label_id]
+    self._subtree_torrents.pop(label_id, None)
+
+    self._changed.add(label_id)
+
+
+  def get_children(self, label_id):
+
+    return sorted(self._children[label_id])
+
+
+  def get_torrents(self, label_id):
+
+    return self._torrents[label_id]
+
+
+  def get_parent(self, label_id):
+
+    return self._parents[label_id]
+
+
+  def get_subtree(self, label_id):
+
+    # The label followed by all its descendants, parents before children
+
+    order = self._get_order()
+
+    return order[self._pre[label_id]:self._post[label_id]+1]
+
+
+  def get_subtree_size(self, label_id):
+
+    self._get_order()
+
+    return self._post[label_id] - self._pre[label_id] + 1
+
+
+  def is_descendant(self, label_id, ancestor_id):
+
+    self._get_order()
+
+    return (self._pre[ancestor_id] < self._pre[label_id] <=
+        self._post[ancestor_id])
+
+
+  def get_subtree_torrents(self, label_id):
+
+    # The returned set is shared with the cache and must not be modified
+
+    torrents = self._subtree_torrents.get(label_id)
+    if torrents is None:
+      torrents = set()
+      for id in self.get_subtree(label_id):
+        torrents |= self._torrents[id]
+
+      self._subtree_torrents[label_id] = torrents
+
+    return torrents
+
+
+  def get_count(self, label_id, include_children=False):
+
+    if include_children:
+      return self._subtree_counts[label_id]
+
+    return len(self._torrents[label_id])
+
+
+  def add_torrent(self, label_id, torrent_id):
+
+    torrents = self._torrents[label_id]
+    if torrent_id not in torrents:
+      torrents.add(torrent_id)
+      self._adjust_counts(label_id, 1)
+
+
+  def remove_torrent(self, label_id, torrent_id):
+
+    torrents = self._torrents[label_id]
+    if torrent_id in torrents:
+      torrents.remove(torrent_id)
+      self._adjust_counts(label_id, -1)
+
+
+  def move_torrent(self, torrent_id, old_label_id, new_label_id):
+
+    if old_label_id:
+      self.remove_torrent(old_label_id, torrent_id)
+
+    if new_label_id:
+      self.add_torrent(new_label_id, torrent_id)
+
+
+  def mark_changed(self, label_id):
+
+    self._changed.add(label_id)
+
+
+  def pop_changed(self):
+
+    changed = self._changed
+    self._changed = set()
+
+    return changed
+
+
+  def _adjust_counts(self, label_id, delta):
+
+    while label_id in self._subtree_counts:
+      self._subtree_counts[label_id] += delta
+      self._subtree_torrents.pop(label_id, None)
+      self._changed.add(label_id)
+
+      label_id = self._parents.get(label_id)
+
+
+  def _get_order(self):
+
+    if self._order is not None:
+      return self._order
+
+    order = []
+    pre = {}
+    post = {}
+
+    roots = [id for id in self._children if self._parents[id] not in
+        self._children]
+
+    # Iterative depth-first walk; a None marker closes the label above it
+    stack = sorted(roots, reverse=True)
+    while stack:
+      id = stack.pop()
+      if id is None:
+        id = stack.pop()
+        post[id] = len(order) - 1
+        continue
+
+      pre[id] = len(order)
+      order.append(id)
+
+      stack.append(id)
+      stack.append(None)
+      stack.extend(sorted(self._children[id], reverse=True))
+
+    self._order = order
+    self._pre = pre
+    self._post = post
+
+    return order
@@ -0,0 +1,280 @@
+#
+# mapping.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import sys
+import array
+import struct
+import binascii
+
+
+HASH_SIZE = 20
+
+FILE_MAGIC = "LPMT"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sBII")
+FILE_LABEL = struct.Struct("<H")
+
+
+def encode_id(torrent_id):
+
+  if not isinstance(torrent_id, basestring) or \
+      len(torrent_id) != HASH_SIZE*2:
+    return None
+
+  try:
+    return binascii.unhexlify(torrent_id)
+  except TypeError:
+    return None
+
+
+class MappingTable(object):
+
+  # Maps torrent ids to label ids using binary info-hashes and interned
+  # label handles stored in flat columns; behaves like a dict otherwise
+
+
+  def __init__(self, mappings=None):
+
+    self._hashes = bytearray()
+    self._handles = array.array("I")
+    self._rows = {}
+
+    self._label_ids = []
+    self._label_handles = {}
+
+    if mappings:
+      self.update(mappings)
+
+
+  def __len__(self):
+
+    return len(self._rows)
+
+
+  def __contains__(self, torrent_id):
+
+    return encode_id(torrent_id) in self._rows
+
+
+  def __iter__(self):
+
+    return self.iterkeys()
+
+
+  def __getitem__(self, torrent_id):
+
+    row = self._rows.get(encode_id(torrent_id))
+    if row is None:
+      raise KeyError(torrent_id)
+
+    return self._label_ids[self._handles[row]]
+
+
+  def __setitem__(self, torrent_id, label_id):
+
+    key = encode_id(torrent_id)
+    if key is None:
+      raise ValueError("Invalid torrent id: %r" % torrent_id)
+
+    handle = self._label_handles.get(label_id)
+    if handle is None:
+      handle = len(self._label_ids)
+      self._label_ids.append(label_id)
+      self._label_handles[label_id] = handle
+
+    row = self._rows.get(key)
+    if row is None:
+      self._rows[key] = len(self._handles)
+      self._hashes.extend(key)
+      self._handles.append(handle)
+    else:
+      self._handles[row] = handle
+
+
+  def __delitem__(self, torrent_id):
+
+    key = encode_id(torrent_id)
+    row = self._rows.pop(key, None)
+    if row is None:
+      raise KeyError(torrent_id)
+
+    # Fill the hole with the last row to keep the columns dense
+    last = len(self._handles) - 1
+    if row != last:
+      offset = last*HASH_SIZE
+      moved = str(self._hashes[offset:offset+HASH_SIZE])
+
+      self._hashes[row*HASH_SIZE:(row+1)*HASH_SIZE] = moved
+      self._handles[row] = self._handles[last]
+      self._rows[moved] = row
+
+    del self._hashes[last*HASH_SIZE:]
+    self._handles.pop()
+
+
+  def get(self, torrent_id, default=None):
+
+    row = self._rows.get(encode_id(torrent_id))
+    if row is None:
+      return default
+
+    return self._label_ids[self._handles[row]]
+
+
+  def pop(self, torrent_id, *args):
+
+    try:
+      label_id = self[torrent_id]
+    except KeyError:
+      if args:
+        return args[0]
+      raise
+
+    del self[torrent_id]
+
+    return label_id
+
+
+  def iterkeys(self):
+
+    hashes = str(self._hashes)
+    for i in xrange(len(self._handles)):
+      yield binascii.hexlify(hashes[i*HASH_SIZE:(i+1)*HASH_SIZE])
+
+
+  def iteritems(self):
+
+    hashes = str(self._hashes)
+    label_ids = self._label_ids
+    for i, handle in enumerate(self._handles):
+      yield (binascii.hexlify(hashes[i*HASH_SIZE:(i+1)*HASH_SIZE]),
+          label_ids[handle])
+
+
+  def keys(self):
+
+    return list(self.iterkeys())
+
+
+  def items(self):
+
+    return list(self.iteritems())
+
+
+  def update(self, mappings):
+
+    if hasattr(mappings, "iteritems"):
+      mappings = mappings.iteritems()
+
+    for torrent_id, label_id in mappings:
+      self[torrent_id] = label_id
+
+
+  def clear(self):
+
+    self.__init__()
+
+
+  def dumps(self):
+
+    self._compact_labels()
+
+    handles = array.array("I", self._handles)
+    if sys.byteorder != "little":
+      handles.byteswap()
+
+    parts = [FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION,
+        len(self._label_ids), len(self._handles))]
+
+    for label_id in self._label_ids:
+      data = label_id.encode("utf8")
+      parts.append(FILE_LABEL.pack(len(data)))
+      parts.append(data)
+
+    parts.append(str(self._hashes))
+    parts.append(handles.tostring())
+
+    return "".join(parts)
+
+
+  def loads(self, data):
+
+    magic, version, num_labels, num_rows = \
+        FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+      raise ValueError("Unrecognized mapping data")
+
+    offset = FILE_HEADER.size
+
+    label_ids = []
+    for i in xrange(num_labels):
+      size, = FILE_LABEL.unpack_from(data, offset)
+      offset += FILE_LABEL.size
+      label_ids.append(data[offset:offset+size].decode("utf8"))
+      offset += size
+
+    hashes = data[offset:offset+num_rows*HASH_SIZE]
+    offset += num_rows*HASH_SIZE
+
+    handles = array.array("I")
+    handles.fromstring(data[offset:offset+num_rows*handles.itemsize])
+    if sys.byteorder != "little":
+      handles.byteswap()
+
+    if len(hashes) != num_rows*HASH_SIZE or len(handles) != num_rows:
+      raise ValueError("Truncated mapping data")
+
+    self._hashes = bytearray(hashes)
+    self._handles = handles
+    self._rows = dict((hashes[i*HASH_SIZE:(i+1)*HASH_SIZE], i)
+        for i in xrange(num_rows))
+
+    self._label_ids = label_ids
+    self._label_handles = dict((v, i) for i, v in enumerate(label_ids))
+
+
+  def _compact_labels(self):
+
+    # Drop label ids that are no longer referenced by any row
+    used = sorted(set(self._handles))
+    if len(used) == len(self._label_ids):
+      return
+
+    remap = dict((old, new) for new, old in enumerate(used))
+
+    self._label_ids = [self._label_ids[i] for i in used]
+    self._label_handles = dict(
+        (v, i) for i, v in enumerate(self._label_ids))
+    self._handles = array.array("I", (remap[h] for h in self._handles))
@@ -0,0 +1,393 @@
+#
+# store.py
+#
+# Copyright (C) 2013 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import json
+import cPickle
+import sqlite3
+import threading
+
+from twisted.internet import threads
+
+from deluge.log import LOG as log
+
+from constant import PLUGIN_NAME
+from constant import NULL_PARENT
+from file import write_atomic
+from journal import MappingJournal
+from mapping import MappingTable
+
+
+BACKEND_CONFIG = "config"
+BACKEND_SQLITE = "sqlite"
+BACKENDS = (BACKEND_CONFIG, BACKEND_SQLITE)
+
+CONFIG_FORMAT = {
+  "file": 1,
+  "format": 1,
+}
+
+
+class ConfigStore(object):
+
+  # Labels live in the plugin config and mappings in a packed sidecar file;
+  # mapping changes are journaled so neither has to be rewritten per change
+
+
+  def __init__(self, config, options, mappings_path, journal_path):
+
+    self.config = config
+    self.options = options
+    self.mappings_path = mappings_path
+
+    self.labels = config["labels"]
+    self.mappings = MappingTable()
+
+    self._journal = MappingJournal(journal_path)
+
+    self._lock = threading.Lock()
+    self._seq = 0
+    self._written_seq = 0
+    self._writing = False
+    self._write_requested = False
+    self._closed = False
+
+
+  def has_data(self):
+
+    return any(id != NULL_PARENT for id in self.config["labels"])
+
+
+  def open(self, source=None):
+
+    migrate = not self.has_data() and source and source.has_data()
+    if migrate:
+      source.open()
+      self.labels.update(source.labels)
+      self.mappings.update(source.mappings)
+    elif self.config["mappings"]:
+      # Mappings were stored in the config by older versions
+      self.mappings.update(self.config["mappings"])
+      self.config["mappings"].clear()
+    elif os.path.exists(self.mappings_path):
+      with open(self.mappings_path, "rb") as f:
+        self.mappings.loads(f.read())
+
+    count = self._journal.replay(self.mappings)
+    if count:
+      log.debug("[%s] Replayed %s journal records", PLUGIN_NAME, count)
+
+    self._journal.open()
+
+    if migrate:
+      self.flush()
+      source.clear()
+      source.close()
+
+      log.info("[%s] Migrated %s labels and %s mappings to config",
+          PLUGIN_NAME, len(self.labels), len(self.mappings))
+
+
+  def record_mapping(self, torrent_id, label_id):
+
+    self._journal.append(torrent_id, label_id)
+
+    # Request a snapshot to compact the journal once it grows too large
+    return self._journal.size >= self.options["journal_limit"]
+
+
+  def record_mappings(self, records):
+
+    self._journal.extend(records)
+
+    return self._journal.size >= self.options["journal_limit"]
+
+
+  def flush(self, background=False):
+
+    if background:
+      self._flush_in_thread()
+      return
+
+    # Supersedes any write that was requested while one was in flight
+    self._write_requested = False
+
+    with self._lock:
+      self._seq += 1
+      self._written_seq = self._seq
+
+      write_atomic(self.mappings_path, self.mappings.dumps())
+      self.config.save()
+
+    # Snapshot now holds every mapping, so journaled records are redundant
+    self._journal.truncate()
+
+
+  def _flush_in_thread(self):
+
+    # Only one write is in flight; changes made meanwhile are picked up by
+    # a follow-up write once it completes
+    if self._writing:
+      self._write_requested = True
+      return
+
+    self._writing = True
+    self._write_requested = False
+
+    self._seq += 1
+    config = cPickle.loads(cPickle.dumps(self.config.config,
+        cPickle.HIGHEST_PROTOCOL))
+    mappings = self.mappings.dumps()
+
+    self._journal.rotate()
+
+    d = threads.deferToThread(self._write_snapshot, self._seq, config,
+        mappings)
+    d.addCallbacks(self._on_snapshot_written, self._on_snapshot_failed)
+
+
+  def _write_snapshot(self, seq, config, mappings):
+
+    data = "%s%s" % (json.dumps(CONFIG_FORMAT, indent=2),
+        json.dumps(config, indent=2))
+
+    with self._lock:
+      # A later snapshot was already written synchronously
+      if seq < self._written_seq:
+        return False
+
+      write_atomic(self.mappings_path, mappings)
+      write_atomic(self.config.config_file, data)
+      self._written_seq = seq
+
+    return True
+
+
+  def _on_snapshot_written(self, written):
+
+    self._writing = False
+    if self._closed:
+      return
+
+    if written:
+      self._journal.discard_rotated()
+
+    if self._write_requested:
+      self._flush_in_thread()
+
+
+  def _on_snapshot_failed(self, failure):
+
+    log.error("[%s] Unable to save config: %s", PLUGIN_NAME,
+        failure.getErrorMessage())
+
+    # Rotated journal records are kept and merged into the next rotation
+    self._writing = False
+    if not self._closed and self._write_requested:
+      self._flush_in_thread()
+
+
+  def clear(self):
+
+    self.labels.clear()
+    self.mappings.clear()
+    self.config["mappings"].clear()
+    self.config.save()
+
+    self._journal.remove()
+
+    if os.path.exists(self.mappings_path):
+      os.remove(self.mappings_path)
+
+
+  def close(self):
+
+    self._closed = True
+    self._journal.close()
+
+
+class SQLiteStore(object):
+
+  # Labels and mappings live in an SQLite database; only rows that changed
+  # since the last flush are written
+
+
+  def __init__(self, config, options, db_path):
+
+    self.config = config
+    self.options = options
+    self.path = db_path
+
+    self.labels = {}
+    self.mappings = MappingTable()
+
+    self._db = None
+    self._written = {}
+    self._pending = {}
+
+
+  def has_data(self):
+
+    if not self._db and not os.path.exists(self.path):
+      return False
+
+    db = self._db or sqlite3.connect(self.path)
+    try:
+      row = db.execute("SELECT 1 FROM labels WHERE id != ? LIMIT 1",
+          (NULL_PARENT,)).fetchone()
+    except sqlite3.OperationalError:
+      row = None
+    finally:
+      if db is not self._db:
+        db.close()
+
+    return row is not None
+
+
+  def open(self, source=None):
+
+    self._db = sqlite3.connect(self.path)
+
+    with self._db:
+      self._db.execute("CREATE TABLE IF NOT EXISTS labels "
+          "(id TEXT PRIMARY KEY, name TEXT, data TEXT)")
+      self._db.execute("CREATE TABLE IF NOT EXISTS mappings "
+          "(torrent_id TEXT PRIMARY KEY, label_id TEXT NOT NULL)")
+      self._db.execute("CREATE INDEX IF NOT EXISTS mappings_label_id "
+          "ON mappings (label_id)")
+
+    if not self.has_data() and source and source.has_data():
+      source.open()
+      self._import(source.labels, source.mappings)
+      source.clear()
+      source.close()
+
+    for id, name, data in self._db.execute(
+        "SELECT id, name, data FROM labels"):
+      self.labels[id] = {
+        "name": name,
+        "data": json.loads(data),
+      }
+
+      self._written[id] = (name, data)
+
+    self.mappings.update(self._db.execute(
+        "SELECT torrent_id, label_id FROM mappings"))
+
+
+  def record_mapping(self, torrent_id, label_id):
+
+    self._pending[torrent_id] = label_id
+
+    return True
+
+
+  def record_mappings(self, records):
+
+    self._pending.update(records)
+
+    return True
+
+
+  def flush(self, background=False):
+
+    # Only changed rows are written, so this always runs on the caller
+
+    encoded = {}
+    for id, obj in self.labels.iteritems():
+      row = (obj["name"], json.dumps(obj["data"]))
+      if self._written.get(id) != row:
+        encoded[id] = (id,) + row
+
+    removed = [id for id in self._written if id not in self.labels]
+
+    with self._db:
+      self._db.executemany("INSERT OR REPLACE INTO labels "
+          "(id, name, data) VALUES (?, ?, ?)", encoded.itervalues())
+      self._db.executemany("DELETE FROM labels WHERE id = ?",
+          ((id,) for id in removed))
+
+      self._db.executemany("INSERT OR REPLACE INTO mappings "
+          "(torrent_id, label_id) VALUES (?, ?)",
+          ((k, v) for k, v in self._pending.iteritems() if v))
+      self._db.executemany("DELETE FROM mappings WHERE torrent_id = ?",
+          ((k,) for k, v in self._pending.iteritems() if not v))
+
+    log.debug("[%s] Wrote %s labels and %s mappings", PLUGIN_NAME,
+        len(encoded) + len(removed), len(self._pending))
+
+    for id in removed:
+      del self._written[id]
+
+    for id, name, data in encoded.itervalues():
+      self._written[id] = (name, data)
+
+    self._pending.clear()
+
+    # Config only holds preferences now
+    self.config.save()
+
+
+  def clear(self):
+
+    with self._db:
+      self._db.execute("DELETE FROM labels")
+      self._db.execute("DELETE FROM mappings")
+
+    self.labels.clear()
+    self.mappings.clear()
+    self._written.clear()
+    self._pending.clear()
+
+
+  def close(self):
+
+    if self._db:
+      self._db.close()
+      self._db = None
+
+
+  def _import(self, labels, mappings):
+
+    with self._db:
+      self._db.executemany("INSERT OR REPLACE INTO labels "
+          "(id, name, data) VALUES (?, ?, ?)",
+          ((k, v["name"], json.dumps(v["data"]))
+            for k, v in labels.iteritems()))
+      self._db.executemany("INSERT OR REPLACE INTO mappings "
+          "(torrent_id, label_id) VALUES (?, ?)", mappings.iteritems())
+
+    log.info("[%s] Migrated %s labels and %s mappings to %s",
+        PLUGIN_NAME, len(labels), len(mappings), self.path)
@@ -35,6 +35,8 @@
 
 import re
 
+from auto_matcher import get_pattern_rule, compile_pattern
+
 
 RE_INVALID_CHARS = re.compile("[\x00-\x1f\x7f\x22\*/:<>\?|\\\\]")
 
@@ -51,6 +53,19 @@ def validate_name(label_name):
   require(not RE_INVALID_CHARS.search(label_name), "Invalid characters")
 
 
+def validate_query(line, patterns):
+
+  if not patterns:
+    return
+
+  source = get_pattern_rule(line)
+  if source is not None:
+    try:
+      compile_pattern(source)
+    except re.error as e:
+      raise LabelPlusError("Invalid pattern: %s (%s)" % (line.strip(), e))
+
+
 class LabelPlusError(Exception):
 
   pass
@@ -40,8 +40,12 @@
 
 
 import os.path
-import cPickle
-import datetime
+import hashlib
+import json
+import time
+import collections
+
+from twisted.internet import reactor
 
 import deluge.common
 import deluge.configmanager
@@ -51,25 +55,56 @@ from deluge.core.rpcserver import export
 from deluge.plugins.pluginbase import CorePluginBase
 
 import common.validation as Validation
-import common.label as Label
 from common.debug import debug
+from common.label_index import LabelIndex
+from common.label_filter import is_expression, parse_filter, evaluate_filter
+from common.auto_matcher import AutoMatcher
+from common.auto_matcher import FIELD_NAME, FIELD_TRACKER
+from common.auto_matcher import match_torrents
+from common.job import ChunkedJob, PoolJob
+from common.event import LabelPlusLabelsChangedEvent
+from common.event import LabelPlusCountsChangedEvent
+from common.event import LabelPlusTorrentsRelabeledEvent
+from common.store import ConfigStore, SQLiteStore
+from common.store import BACKEND_SQLITE, BACKENDS
 
 from common.constant import PLUGIN_NAME, MODULE_NAME
-from common.constant import CORE_CONFIG
+from common.constant import CORE_CONFIG, CORE_MAPPINGS, CORE_JOURNAL
+from common.constant import CORE_DATABASE
 from common.constant import STATUS_ID, STATUS_NAME
 from common.constant import OPTION_DEFAULTS, LABEL_DEFAULTS
 from common.constant import NULL_PARENT, ID_ALL, ID_NONE
 from common.constant import RESERVED_IDS
 
 
+CONFIG_VERSION = 1
+
+MAX_CHANGE_LOG = 1000
+
+JOB_CHUNK_SIZE = 500
+
+# Alerts after which a torrent's cached name or save path may be stale
+STATUS_ALERTS = (
+  "metadata_received_alert",
+  "file_renamed_alert",
+  "storage_moved_alert",
+)
+MAX_FINISHED_JOBS = 20
+
+# Changes whenever the config layout or the option/label defaults change
+SCHEMA_VERSION = "%s:%s" % (CONFIG_VERSION, hashlib.sha1(json.dumps(
+    (OPTION_DEFAULTS, LABEL_DEFAULTS), sort_keys=True)).hexdigest()[:8])
+
 CONFIG_DEFAULTS = {
+  "version": None, # SCHEMA_VERSION of the stored data
+
   "prefs": {
     "options": dict(OPTION_DEFAULTS),
     "defaults": dict(LABEL_DEFAULTS),
   },
 
   "labels": {},   # "label_id": {"name": str, "data": dict}
-  "mappings": {}, # "torrent_id": "label_id"
+  "mappings": {}, # Only used by older versions, see CORE_MAPPINGS
 }
 
 
@@ -106,8 +141,60 @@ class Core(CorePluginBase):
 
     self._prefs = self._config["prefs"]
 
-    self._labels = self._config["labels"]
-    self._mappings = self._config["mappings"]
+    self._store = None
+    self._index = None
+    self._counts = None
+    self._matcher = None
+
+    self._jobs = collections.OrderedDict()
+    self._next_job_id = 1
+
+    # Generations start from the clock so they keep increasing across restarts
+    self._generation = int(time.time()*1000)
+    self._base_generation = self._generation
+    self._label_generations = {}
+    self._prefs_generation = self._generation
+    self._counts_generation = self._generation
+    self._change_log = collections.deque()
+    self._log_floor = self._generation
+
+    self._event_call = None
+    self._emitted_generation = self._generation
+    self._labels_changed = False
+    self._relabeled = {}
+    self._save_call = None
+    self._save_pending = 0
+
+    self._added = []
+    self._added_call = None
+    self._added_time = None
+
+    self._removed = []
+    self._removed_call = None
+
+    self._status_cache = {}
+    self._label_names = {}
+    self._applied = {}
+
+    self._filter_cache = {}
+    self._filter_key = None
+    self._session_generation = 0
+
+    self._stats = {
+      "added_batches": 0,
+      "added_torrents": 0,
+      "added_labeled": 0,
+      "added_max_batch": 0,
+      "added_latency": 0.0,
+      "added_max_latency": 0.0,
+      "removed_batches": 0,
+      "removed_torrents": 0,
+      "removed_labeled": 0,
+      "removed_coalesced": 0,
+      "removed_max_batch": 0,
+      "setters_applied": 0,
+      "setters_skipped": 0,
+    }
 
     if not component.get("TorrentManager").session_started:
       component.get("EventManager").register_event_handler(
@@ -124,11 +211,28 @@ class Core(CorePluginBase):
     component.get("EventManager").deregister_event_handler(
         "SessionStartedEvent", self._initialize)
 
+    # Pending removals must reach the store before it is saved
+    if self._removed_call and self._removed_call.active():
+      self._removed_call.cancel()
+      self._process_removed()
+
     self.initialized = False
 
-    self._config.save()
+    if self._event_call and self._event_call.active():
+      self._event_call.cancel()
+
+    for job in self._jobs.itervalues():
+      job.cancel()
+
+    if self._added_call and self._added_call.active():
+      self._added_call.cancel()
+
+    self._flush_config()
     deluge.configmanager.close(self._config)
 
+    if self._store:
+      self._store.close()
+
     component.get("EventManager").deregister_event_handler(
         "TorrentAddedEvent", self.on_torrent_added)
     component.get("EventManager").deregister_event_handler(
@@ -136,6 +240,11 @@ class Core(CorePluginBase):
 
     component.get("AlertManager").deregister_handler(
         self.on_torrent_finished)
+    component.get("AlertManager").deregister_handler(
+        self.on_torrent_status_changed)
+
+    self._status_cache.clear()
+    self._applied.clear()
 
     component.get("CorePluginManager").deregister_status_field(STATUS_ID)
     component.get("CorePluginManager").deregister_status_field(STATUS_NAME)
@@ -153,6 +262,14 @@ class Core(CorePluginBase):
     return self.initialized
 
 
+  @export
+  @init_check
+  @debug()
+  def flush_config(self):
+
+    self._flush_config()
+
+
   @export
   @init_check
   @debug()
@@ -164,17 +281,13 @@ class Core(CorePluginBase):
     self._validate_name(parent_id, label_name)
 
     id = self._get_unused_id(parent_id)
-    self._index[parent_id]["children"].append(id)
 
     self._labels[id] = {
       "name": label_name,
       "data": dict(self._prefs["defaults"]),
     }
 
-    self._index[id] = {
-      "children": [],
-      "torrents": [],
-    }
+    self._index.add_label(id)
 
     options = self._labels[id]["data"]
     mode = options["move_data_completed_mode"]
@@ -186,10 +299,12 @@ class Core(CorePluginBase):
 
       options["move_data_completed_path"] = path
 
-    self._build_label_ancestry(id)
+    self._render_label_names(id)
 
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    self._matcher = None
+    self._label_generations[id] = self._bump_generation()
+    self._schedule_events(labels_changed=True)
+    self._save_config()
 
     return id
 
@@ -204,11 +319,10 @@ class Core(CorePluginBase):
 
     self._remove_label(label_id)
 
-    parent_id = Label.get_parent(label_id)
-    self._index[parent_id]["children"].remove(label_id)
-
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    self._matcher = None
+    self._bump_generation()
+    self._schedule_events(labels_changed=True)
+    self._save_config()
 
 
   @export
@@ -220,12 +334,14 @@ class Core(CorePluginBase):
         label_id in self._labels, "Unknown Label")
 
     label_name = label_name.strip()
-    self._validate_name(Label.get_parent(label_id), label_name)
+    self._validate_name(self._index.get_parent(label_id), label_name)
 
     obj = self._labels[label_id]
     obj["name"] = label_name
 
-    self._clear_subtree_ancestry(label_id)
+    self._index.mark_changed(label_id)
+    self._render_label_names(label_id)
+    self._label_generations[label_id] = self._bump_generation()
 
     if obj["data"]["move_data_completed_mode"] == "subfolder":
       path = os.path.join(self.get_parent_path(label_id), label_name)
@@ -234,8 +350,8 @@ class Core(CorePluginBase):
       self._apply_data_completed_path(label_id)
       self._propagate_path_to_descendents(label_id)
 
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    self._schedule_events(labels_changed=True)
+    self._save_config()
 
     if (obj["data"]["move_data_completed_mode"] == "subfolder" and
         self._prefs["options"]["move_on_changes"]):
@@ -244,19 +360,52 @@ class Core(CorePluginBase):
 
   @export
   @init_check
-  def get_label_data(self, timestamp):
+  def get_generation(self):
 
-    if timestamp:
-      t = cPickle.loads(timestamp)
-    else:
-      t = datetime.datetime(1, 1, 1)
+    return self._generation
+
+
+  @export
+  @init_check
+  def get_label_data(self, generation=None):
+
+    self._update_label_counts()
 
-    if t < self._last_modified:
-      return (cPickle.dumps(self._last_modified), self._get_label_counts())
+    if self._is_modified(self._counts_generation, generation):
+      return (self._generation, self._counts)
     else:
       return None
 
 
+  @export
+  @init_check
+  def get_label_updates(self, version=None):
+
+    self._update_label_counts()
+
+    if not self._is_modified(self._counts_generation, version):
+      return None
+
+    if version is None or not self._log_floor <= version < self._generation:
+      return (self._generation, True, self._counts, [])
+
+    changed = set()
+    for entry_version, ids in reversed(self._change_log):
+      if entry_version <= version: break
+
+      changed.update(ids)
+
+    counts = {}
+    removed = []
+    for id in changed:
+      if id in self._counts:
+        counts[id] = self._counts[id]
+      else:
+        removed.append(id)
+
+    return (self._generation, False, counts, removed)
+
+
   @export
   @init_check
   @debug()
@@ -274,20 +423,24 @@ class Core(CorePluginBase):
     old_move = options["move_data_completed"]
     old_move_path = options["move_data_completed_path"]
 
+    for line in options_in["auto_queries"]:
+      Validation.validate_query(line,
+          options_in.get("auto_patterns", options["auto_patterns"]))
+
     self._normalize_label_data(options_in)
     options.update(options_in)
 
-    self._config.save()
+    self._matcher = None
+    self._label_generations[label_id] = self._bump_generation()
 
-    for id in self._index[label_id]["torrents"]:
-      self._apply_torrent_options(id)
+    vector = self._get_option_vector(label_id)
+    for id in self._index.get_torrents(label_id):
+      self._apply_torrent_options(id, vector)
 
     # Make sure descendent labels are updated if path changed
     if old_move_path != options["move_data_completed_path"]:
       self._propagate_path_to_descendents(label_id)
 
-      self._config.save()
-
       if self._prefs["options"]["move_on_changes"]:
         self._subtree_move_completed(label_id)
     else:
@@ -296,20 +449,46 @@ class Core(CorePluginBase):
           options["move_data_completed"] and
           (not old_download or not old_move) and
           self._prefs["options"]["move_on_changes"]):
-        self._do_move_completed(label_id, self._index[label_id]["torrents"])
+        self._do_move_completed(label_id,
+            list(self._index.get_torrents(label_id)))
 
+    job_id = None
     if options["auto_settings"] and retroactive:
-      autolabel = []
-      for torrent_id in self._torrents:
-        if not unlabeled_only or torrent_id not in self._mappings:
-          if self._has_auto_apply_match(label_id, torrent_id):
-            autolabel.append(torrent_id)
+      rule = self._get_auto_rule(label_id)
+      job_id = self._start_match_job(AutoMatcher([rule] if rule else []),
+          unlabeled_only, label_id)
+
+    self._schedule_events(labels_changed=True)
+    self._save_config()
+
+    return job_id
+
+
+  @export
+  @init_check
+  @debug()
+  def reevaluate_rules(self, unlabeled_only=True):
+
+    return self._start_match_job(self._get_auto_matcher(), unlabeled_only)
+
+
+  @export
+  @init_check
+  def get_job_status(self, job_id):
 
-      if autolabel:
-        self.set_torrent_labels(label_id, autolabel)
+    Validation.require(job_id in self._jobs, "Unknown Job")
 
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    return self._jobs[job_id].get_status()
+
+
+  @export
+  @init_check
+  @debug()
+  def cancel_job(self, job_id):
+
+    Validation.require(job_id in self._jobs, "Unknown Job")
+
+    self._jobs[job_id].cancel()
 
 
   @export
@@ -323,19 +502,44 @@ class Core(CorePluginBase):
     return self._labels[label_id]["data"]
 
 
+  @export
+  @init_check
+  def get_options_if_modified(self, label_id, generation):
+
+    Validation.require(label_id not in RESERVED_IDS and
+        label_id in self._labels, "Unknown Label")
+
+    modified = self._label_generations.get(label_id, self._base_generation)
+    if self._is_modified(modified, generation):
+      return (self._generation, self._labels[label_id]["data"])
+    else:
+      return None
+
+
   @export
   @init_check
   @debug()
   def set_preferences(self, prefs):
 
+    defaults = prefs["defaults"]
+    for line in defaults["auto_queries"]:
+      Validation.validate_query(line, defaults.get("auto_patterns"))
+
     self._normalize_options(prefs["options"])
     self._prefs["options"].update(prefs["options"])
 
+    # Counts differ depending on include_children
+    self._counts = None
+
+    # Names differ depending on show_full_name
+    self._render_label_names()
+
     self._normalize_label_data(prefs["defaults"])
     self._prefs["defaults"].update(prefs["defaults"])
 
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    self._prefs_generation = self._bump_generation()
+    self._schedule_events(labels_changed=True)
+    self._save_config()
 
 
   @export
@@ -346,6 +550,16 @@ class Core(CorePluginBase):
     return self._prefs
 
 
+  @export
+  @init_check
+  def get_preferences_if_modified(self, generation):
+
+    if self._is_modified(self._prefs_generation, generation):
+      return (self._generation, self._prefs)
+    else:
+      return None
+
+
   @export
   @init_check
   def get_parent_path(self, label_id):
@@ -353,7 +567,7 @@ class Core(CorePluginBase):
     Validation.require(label_id not in RESERVED_IDS and
         label_id in self._labels, "Unknown Label")
 
-    parent_id = Label.get_parent(label_id)
+    parent_id = self._index.get_parent(label_id)
     if parent_id == NULL_PARENT:
       path = self._get_default_save_path()
     else:
@@ -371,11 +585,13 @@ class Core(CorePluginBase):
         label_id in self._labels) or (not label_id), "Unknown Label")
 
     torrents = [t for t in torrent_list if t in self._torrents]
+    changed = False
     for id in torrents:
-      self._set_torrent_label(id, label_id)
+      changed |= self._set_torrent_label(id, label_id)
 
-    self._last_modified = datetime.datetime.now()
-    self._config.save()
+    if changed:
+      self._bump_generation()
+      self._schedule_events()
 
     self._do_move_completed(label_id, torrents)
 
@@ -388,6 +604,23 @@ class Core(CorePluginBase):
     return self._get_torrent_label(torrent_id)
 
 
+  @export
+  @init_check
+  def get_torrent_label_names(self, torrent_ids):
+
+    names = self._label_names
+    mappings = self._mappings
+
+    return dict((id, names.get(mappings.get(id), "")) for id in torrent_ids)
+
+
+  @export
+  @init_check
+  def get_stats(self):
+
+    return dict(self._stats)
+
+
   @export
   @init_check
   def get_daemon_vars(self):
@@ -402,36 +635,122 @@ class Core(CorePluginBase):
   @debug(show_args=True)
   def on_torrent_added(self, torrent_id):
 
-    for label_id in self._labels:
-      if label_id == NULL_PARENT: continue
+    # Torrents added during this reactor iteration are handled together
+    self._added.append(torrent_id)
+    self._session_generation += 1
 
-      if self._labels[label_id]["data"]["auto_settings"]:
-        if self._has_auto_apply_match(label_id, torrent_id):
-          self._set_torrent_label(torrent_id, label_id)
+    if not self._added_call or not self._added_call.active():
+      self._added_time = time.time()
+      self._added_call = reactor.callLater(0, self._process_added)
+
+
+  def _process_added(self):
+
+    self._added_call = None
+
+    torrents = [t for t in self._added if t in self._torrents]
+    self._added = []
+
+    records = []
+    matcher = self._get_auto_matcher()
+    if matcher:
+      for torrent_id in torrents:
+        # A label set since the add, e.g. from the add dialog, is kept
+        if torrent_id in self._mappings:
+          continue
+
+        label_id = self._match_torrent(matcher, torrent_id)
+        if label_id:
+          self._move_torrent_label(torrent_id, label_id)
           log.debug("[%s] Torrent %s is labeled %s", PLUGIN_NAME,
               torrent_id, label_id)
 
-          self._config.save()
+          records.append((torrent_id, label_id))
+
+    # The whole batch goes to the store in one write
+    if records:
+      self._record_mappings(records)
+      self._bump_generation()
+
+    labeled = len(records)
+
+    # The All and None counts change even if nothing was labeled
+    self._schedule_events()
+
+    latency = time.time() - self._added_time
 
-          break
+    stats = self._stats
+    stats["added_batches"] += 1
+    stats["added_torrents"] += len(torrents)
+    stats["added_labeled"] += labeled
+    stats["added_max_batch"] = max(stats["added_max_batch"], len(torrents))
+    stats["added_latency"] += latency
+    stats["added_max_latency"] = max(stats["added_max_latency"], latency)
 
-    self._last_modified = datetime.datetime.now()
+    log.debug("[%s] Processed %s added torrents in %.3fs, %s labeled",
+        PLUGIN_NAME, len(torrents), latency, labeled)
 
 
   @debug(show_args=True)
   def on_torrent_removed(self, torrent_id):
 
-    if torrent_id in self._mappings:
-      label_id = self._mappings[torrent_id]
-      log.debug("[%s] Torrent %s is mapped to %s", PLUGIN_NAME,
-          torrent_id, label_id)
-      self._index[label_id]["torrents"].remove(torrent_id)
-      del self._mappings[torrent_id]
-      log.debug("[%s] Torrent removed from index and mappings", PLUGIN_NAME)
+    # The mapping goes at once so nothing acts on a torrent that is leaving;
+    # the store write and events are batched for this reactor iteration
+    self._status_cache.pop(torrent_id, None)
+    self._applied.pop(torrent_id, None)
+
+    label_id = self._mappings.pop(torrent_id, None)
+    if label_id:
+      self._index.remove_torrent(label_id, torrent_id)
+
+    self._removed.append((torrent_id, label_id,
+        self._torrents.get(torrent_id)))
+
+    if not self._removed_call or not self._removed_call.active():
+      self._removed_call = reactor.callLater(0, self._process_removed)
+
+
+  def _process_removed(self):
 
-      self._config.save()
+    self._removed_call = None
 
-    self._last_modified = datetime.datetime.now()
+    removed = self._removed
+    self._removed = []
+
+    records = []
+    for id, label_id, torrent in removed:
+      if not label_id or id in self._mappings:
+        # Unlabeled, or labeled again after being re-added
+        continue
+
+      if self._torrents.get(id) is torrent and label_id in self._labels:
+        # The session failed to remove the torrent, so it keeps its label
+        self._mappings[id] = label_id
+        self._index.add_torrent(label_id, id)
+      else:
+        records.append((id, None))
+
+    if records:
+      self._record_mappings(records)
+      self._bump_generation()
+
+    if removed:
+      self._session_generation += 1
+
+    self._schedule_events()
+
+    labeled = sum(1 for x in removed if x[1])
+
+    stats = self._stats
+    stats["removed_batches"] += 1
+    stats["removed_torrents"] += len(removed)
+    stats["removed_labeled"] += labeled
+    stats["removed_coalesced"] += len(removed) - 1
+    stats["removed_max_batch"] = max(stats["removed_max_batch"],
+        len(removed))
+
+    log.debug("[%s] Processed %s removed torrents, %s were labeled",
+        PLUGIN_NAME, len(removed), labeled)
 
 
   @debug()
@@ -442,13 +761,19 @@ class Core(CorePluginBase):
     if torrent_id in self._mappings:
       log.debug("[%s] Labeled torrent %s finished", PLUGIN_NAME, torrent_id)
       label_id = self._mappings[torrent_id]
-      torrent = self._torrents[torrent_id]
 
-      path = torrent.get_status(["save_path"])["save_path"]
+      path = self._get_status_snapshot(torrent_id)["save_path"]
       if path != self._labels[label_id]["data"]["move_data_completed_path"]:
         self._do_move_completed(label_id, [torrent_id])
 
 
+  @debug()
+  def on_torrent_status_changed(self, alert):
+
+    torrent_id = str(alert.handle.info_hash())
+    self._status_cache.pop(torrent_id, None)
+
+
   def _initialize(self):
 
     component.get("EventManager").deregister_event_handler(
@@ -456,9 +781,13 @@ class Core(CorePluginBase):
 
     self._torrents = component.get("TorrentManager").torrents
 
+    self._normalize_options(self._prefs["options"])
+
+    self._open_store()
     self._initialize_data()
     self._build_index()
     self._remove_orphans()
+    self._render_label_names()
 
     component.get("FilterManager").register_filter(
         STATUS_ID, self._filter_by_label)
@@ -476,97 +805,226 @@ class Core(CorePluginBase):
     component.get("AlertManager").register_handler(
         "torrent_finished_alert", self.on_torrent_finished)
 
-    self._last_modified = datetime.datetime.now()
+    for alert in STATUS_ALERTS:
+      component.get("AlertManager").register_handler(
+          alert, self.on_torrent_status_changed)
+
     self.initialized = True
 
     log.debug("[%s] Core initialized", PLUGIN_NAME)
 
 
+  def _open_store(self):
+
+    options = self._prefs["options"]
+    get_path = deluge.configmanager.get_config_dir
+
+    config_store = ConfigStore(self._config, options,
+        get_path(CORE_MAPPINGS), get_path(CORE_JOURNAL))
+    sqlite_store = SQLiteStore(self._config, options,
+        get_path(CORE_DATABASE))
+
+    # The store not in use is only opened to migrate its data
+    backend = options["storage_backend"]
+    if backend == BACKEND_SQLITE:
+      self._store = sqlite_store
+      self._store.open(config_store)
+    else:
+      self._store = config_store
+      self._store.open(sqlite_store)
+
+    log.debug("[%s] Using %s storage backend", PLUGIN_NAME, backend)
+
+    self._labels = self._store.labels
+    self._mappings = self._store.mappings
+
+
   def _initialize_data(self):
 
+    pruned = 0
     for id in self._mappings.keys():
       if id not in self._torrents or self._mappings[id] not in self._labels:
         del self._mappings[id]
+        self._record_mapping(id, None)
+        pruned += 1
 
-    for id in RESERVED_IDS:
-      if id in self._labels:
-        del self._labels[id]
+    if pruned:
+      log.debug("[%s] Pruned %s stale mappings", PLUGIN_NAME, pruned)
 
-    for id in self._labels:
-      self._normalize_label_data(self._labels[id]["data"])
+    if self._config["version"] != SCHEMA_VERSION:
+      self._migrate_data()
 
-    self._labels[NULL_PARENT] = {
+    null_label = {
       "name": None,
       "data": None,
     }
 
-    self._normalize_options(self._prefs["options"])
-    self._normalize_label_data(self._prefs["defaults"])
+    if self._labels.get(NULL_PARENT) != null_label:
+      self._labels[NULL_PARENT] = null_label
+      self._save_config()
 
-    self._config.save()
 
+  def _migrate_data(self):
 
-  def _build_index(self):
+    start = time.time()
+    old_version = self._config["version"]
+
+    for id in RESERVED_IDS:
+      if id in self._labels:
+        del self._labels[id]
 
-    index = {}
     for id in self._labels:
-      children = []
-      torrents = []
+      self._normalize_label_data(self._labels[id]["data"])
 
-      for child_id in self._labels:
-        if child_id == id: continue
+    self._normalize_label_data(self._prefs["defaults"])
 
-        if Label.get_parent(child_id) == id:
-          children.append(child_id)
+    self._config["version"] = SCHEMA_VERSION
+    self._save_config()
 
-      for torrent_id in self._mappings:
-        if self._mappings[torrent_id] == id:
-          torrents.append(torrent_id)
+    log.info("[%s] Migrated data from version %s to %s: "
+        "%s labels normalized in %.3fs", PLUGIN_NAME, old_version,
+        SCHEMA_VERSION, len(self._labels), time.time() - start)
 
-      index[id] = {
-        "children": children,
-        "torrents": torrents,
-      }
 
-    self._index = index
+  def _build_index(self):
 
-    for id in self._labels:
-      self._build_label_ancestry(id)
+    self._index = LabelIndex.build(self._labels, self._mappings)
 
 
   def _remove_orphans(self):
 
-    removals = []
-    for id in self._labels:
-      if id == NULL_PARENT: continue
-
-      parent_id = Label.get_parent(id)
-      if not self._labels.get(parent_id):
-        removals.append(id)
+    removals = [id for id in self._index if id != NULL_PARENT and
+        not self._index.is_descendant(id, NULL_PARENT)]
 
+    # Removing an orphan also removes any orphans under it
     for id in removals:
-      self._remove_label(id)
+      if id in self._labels:
+        self._remove_label(id)
 
 
   def _filter_by_label(self, torrent_ids, label_ids):
 
-    filtered = []
+    include_children = self._prefs["options"]["include_children"]
 
-    for id in torrent_ids:
-      label_id = self._mappings.get(id)
+    selected = set()
+    for label_id in label_ids:
+      if is_expression(label_id):
+        selected |= self._get_filter_result(label_id)
+        continue
 
-      if not label_id:
-        if ID_NONE in label_ids:
-          filtered.append(id)
-      elif label_id in label_ids:
-        filtered.append(id)
-      elif self._prefs["options"]["include_children"]:
-        if any(x for x in label_ids if Label.is_ancestor(x, label_id)):
-          filtered.append(id)
+      if label_id in RESERVED_IDS or label_id not in self._index:
+        continue
+
+      if include_children:
+        selected |= self._index.get_subtree_torrents(label_id)
+      else:
+        selected |= self._index.get_torrents(label_id)
+
+    if len(torrent_ids) >= len(self._torrents):
+      # Every torrent in the session is a candidate
+      filtered = [id for id in selected if id in self._torrents]
+    elif len(selected) < len(torrent_ids):
+      candidates = set(torrent_ids)
+      filtered = [id for id in selected if id in candidates]
+    else:
+      filtered = [id for id in torrent_ids if id in selected]
+
+    if ID_NONE in label_ids:
+      filtered.extend(id for id in torrent_ids if id not in self._mappings)
 
     return filtered
 
 
+  def _get_filter_result(self, expression):
+
+    # Results stay valid until labels change or torrents join or leave
+    key = (self._generation, self._session_generation)
+    if self._filter_key != key:
+      self._filter_cache.clear()
+      self._filter_key = key
+
+    result = self._filter_cache.get(expression)
+    if result is None:
+      result = evaluate_filter(parse_filter(expression),
+          self._resolve_filter_id, self._get_session_torrents)
+      self._filter_cache[expression] = result
+
+    return result
+
+
+  def _resolve_filter_id(self, label_id):
+
+    if label_id == ID_ALL:
+      return self._get_session_torrents()
+    elif label_id == ID_NONE:
+      return self._get_session_torrents() - set(self._mappings.iterkeys())
+    elif label_id == NULL_PARENT or label_id not in self._index:
+      return set()
+
+    if self._prefs["options"]["include_children"]:
+      return self._index.get_subtree_torrents(label_id)
+    else:
+      return self._index.get_torrents(label_id)
+
+
+  def _get_session_torrents(self):
+
+    # Cached with the filter results, under a key no expression can have
+    torrents = self._filter_cache.get(None)
+    if torrents is None:
+      torrents = set(self._torrents)
+      self._filter_cache[None] = torrents
+
+    return torrents
+
+
+  def _save_config(self):
+
+    self._save_pending += 1
+
+    options = self._prefs["options"]
+    if self._save_pending >= options["save_threshold"]:
+      self._flush_config()
+    elif not self._save_call or not self._save_call.active():
+      self._save_call = reactor.callLater(options["save_interval"],
+          self._flush_config)
+
+
+  def _flush_config(self):
+
+    if self._save_call and self._save_call.active():
+      self._save_call.cancel()
+
+    self._save_call = None
+
+    if self._save_pending:
+      log.debug("[%s] Saving config (%s pending changes)", PLUGIN_NAME,
+          self._save_pending)
+      self._save_pending = 0
+
+      if self._store:
+        # Always write synchronously when shutting down
+        background = (self.initialized and
+            self._prefs["options"]["threaded_save"])
+        self._store.flush(background)
+      else:
+        self._config.save()
+
+
+  def _record_mapping(self, torrent_id, label_id):
+
+    if self._store.record_mapping(torrent_id, label_id):
+      if not self._save_pending:
+        self._save_config()
+
+
+  def _record_mappings(self, records):
+
+    if self._store.record_mappings(records):
+      if not self._save_pending:
+        self._save_config()
+
+
   def _get_unused_id(self, parent_id):
 
     i = 0
@@ -582,7 +1040,7 @@ class Core(CorePluginBase):
   def _get_children_names(self, parent_id):
 
     names = []
-    for id in self._index[parent_id]["children"]:
+    for id in self._index.get_children(parent_id):
       names.append(self._labels[id]["name"])
 
     return names
@@ -598,71 +1056,174 @@ class Core(CorePluginBase):
 
   def _remove_label(self, label_id):
 
-    for id in self._index[label_id]["children"]:
-      self._remove_label(id)
+    vector = self._get_option_vector(None)
 
-    for id in self._index[label_id]["torrents"]:
-      self._apply_torrent_options(id, reset=True)
+    # Descendants are removed before their parents
+    for id in reversed(self._index.get_subtree(label_id)):
+      for torrent_id in self._index.get_torrents(id):
+        self._apply_torrent_options(torrent_id, vector)
 
-      del self._mappings[id]
+        del self._mappings[torrent_id]
+        self._record_mapping(torrent_id, None)
+        self._relabeled[torrent_id] = ""
 
-    del self._index[label_id]
-    del self._labels[label_id]
+      self._cancel_jobs(id)
+
+      self._index.remove_label(id)
+      self._label_names.pop(id, None)
+      del self._labels[id]
 
 
-  @debug(show_args=True)
   def _set_torrent_label(self, torrent_id, label_id):
 
+    changed = self._move_torrent_label(torrent_id, label_id)
+    if changed:
+      self._record_mapping(torrent_id, label_id)
+
+    return changed
+
+
+  @debug(show_args=True)
+  def _move_torrent_label(self, torrent_id, label_id):
+
+    # Same as _set_torrent_label, but leaves recording the change in the
+    # store to the caller
+
     log.debug("[%s] Setting label %s on %s", PLUGIN_NAME,
         label_id, torrent_id)
 
     id = self._mappings.get(torrent_id)
     if id is not None:
       log.debug("[%s] Torrent current mapping: %s", PLUGIN_NAME, id)
-      self._apply_torrent_options(torrent_id, reset=True)
-      self._index[id]["torrents"].remove(torrent_id)
       del self._mappings[torrent_id]
-      log.debug("[%s] Torrent removed from index and mappings", PLUGIN_NAME)
+      log.debug("[%s] Torrent removed from mappings", PLUGIN_NAME)
 
+    # Options of the new label cover every setting, so there is nothing to
+    # reset first
     if label_id:
       self._mappings[torrent_id] = label_id
-      self._index[label_id]["torrents"].append(torrent_id)
-      self._apply_torrent_options(torrent_id)
+      self._apply_torrent_options(torrent_id,
+          self._get_option_vector(label_id))
       log.debug("[%s] Torrent labeled %s and options applied",
           PLUGIN_NAME, label_id)
+    elif id is not None:
+      self._apply_torrent_options(torrent_id, self._get_option_vector(None))
 
+    self._index.move_torrent(torrent_id, id, label_id)
 
-  def _get_label_counts(self):
+    if id != (label_id or None):
+      self._relabeled[torrent_id] = label_id or ""
+      return True
+
+    return False
+
+
+  def _bump_generation(self):
+
+    self._generation += 1
+
+    return self._generation
+
+
+  def _is_modified(self, modified, generation):
+
+    # Anything not issued by this session, including the pickled timestamps
+    # used by older clients, is treated as stale
+    if not isinstance(generation, (int, long)):
+      return True
+
+    return not modified <= generation <= self._generation
+
+
+  def _schedule_events(self, labels_changed=False):
+
+    if labels_changed:
+      self._labels_changed = True
+
+    # Coalesce all changes made during this reactor iteration
+    if not self._event_call or not self._event_call.active():
+      self._event_call = reactor.callLater(0, self._emit_events)
+
+
+  def _emit_events(self):
+
+    self._event_call = None
+    if not self.initialized:
+      return
+
+    self._update_label_counts()
+
+    event_manager = component.get("EventManager")
+
+    if self._labels_changed:
+      self._labels_changed = False
+      event_manager.emit(LabelPlusLabelsChangedEvent(self._generation))
+
+    if self._emitted_generation != self._counts_generation:
+      self._emitted_generation = self._counts_generation
+      event_manager.emit(LabelPlusCountsChangedEvent(self._generation))
+
+    if self._relabeled:
+      event_manager.emit(LabelPlusTorrentsRelabeledEvent(self._relabeled))
+      self._relabeled = {}
 
-    label_count = 0
-    counts = {}
-    for id in sorted(self._labels, reverse=True):
-      if id == NULL_PARENT: continue
 
-      count = len(self._index[id]["torrents"])
-      label_count += count
+  def _update_label_counts(self):
 
-      if self._prefs["options"]["include_children"]:
-        for child in self._index[id]["children"]:
-          count += counts[child]["count"]
+    include_children = self._prefs["options"]["include_children"]
 
-      counts[id] = {
-        "name": self._labels[id]["name"],
-        "count": count,
-      }
+    reset = self._counts is None
+    if reset:
+      self._counts = {}
+      changed = self._labels.keys()
+      self._index.pop_changed()
+    else:
+      changed = self._index.pop_changed()
 
     total = len(self._torrents)
-    counts[ID_ALL] = {
-      "name": ID_ALL,
-      "count": total,
+    entries = {
+      ID_ALL: {
+        "name": ID_ALL,
+        "count": total,
+      },
+      ID_NONE: {
+        "name": ID_NONE,
+        "count": total - self._index.get_count(NULL_PARENT, True),
+      },
     }
 
-    counts[ID_NONE] = {
-      "name": ID_NONE,
-      "count": total-label_count,
-    }
+    for id in changed:
+      if id == NULL_PARENT: continue
 
-    return counts
+      if id in self._index:
+        entries[id] = {
+          "name": self._labels[id]["name"],
+          "count": self._index.get_count(id, include_children),
+        }
+      else:
+        entries[id] = None
+
+    counts = self._counts
+    updated = set()
+    for id, entry in entries.iteritems():
+      if entry is None:
+        if id in counts:
+          del counts[id]
+          updated.add(id)
+      elif counts.get(id) != entry:
+        counts[id] = entry
+        updated.add(id)
+
+    if reset:
+      self._counts_generation = self._bump_generation()
+      self._change_log.clear()
+      self._log_floor = self._generation
+    elif updated:
+      self._counts_generation = self._bump_generation()
+      self._change_log.append((self._generation, updated))
+
+      if len(self._change_log) > MAX_CHANGE_LOG:
+        self._log_floor = self._change_log.popleft()[0]
 
 
   def _get_torrent_label(self, torrent_id):
@@ -672,74 +1233,176 @@ class Core(CorePluginBase):
 
   def _get_torrent_label_name(self, torrent_id):
 
-    label_id = self._mappings.get(torrent_id)
-    if not label_id:
-      return ""
+    return self._label_names.get(self._mappings.get(torrent_id), "")
+
+
+  def _render_label_names(self, label_id=NULL_PARENT):
+
+    # Pre-order, so a parent's full name is ready before its children's
+    full_name = self._prefs["options"]["show_full_name"]
+    names = self._label_names
+
+    for id in self._index.get_subtree(label_id):
+      if id == NULL_PARENT: continue
+
+      name = self._labels[id]["name"]
+      if full_name:
+        parent_id = self._index.get_parent(id)
+        if parent_id != NULL_PARENT:
+          name = "%s/%s" % (names[parent_id], name)
 
-    if self._prefs["options"]["show_full_name"]:
-      name = self._get_label_ancestry(label_id)
+      names[id] = name
+
+
+  def _get_auto_rule(self, label_id):
+
+    options = self._labels[label_id]["data"]
+    if not options["auto_settings"]:
+      return None
+
+    if options["auto_name"]:
+      field = FIELD_NAME
+    elif options["auto_tracker"]:
+      field = FIELD_TRACKER
     else:
-      name = self._labels[label_id]["name"]
+      return None
 
-    return name
+    return (label_id, field, options["auto_queries"],
+        options["auto_patterns"])
 
 
-  def _get_label_ancestry(self, label_id):
+  def _get_auto_matcher(self):
 
-    ancestry_str = self._index[label_id].get("ancestry")
-    if ancestry_str:
-      return ancestry_str
+    # Rebuilt lazily after any change to label options
+    if self._matcher is None:
+      rules = []
+      for label_id in self._labels:
+        if label_id == NULL_PARENT: continue
 
-    return self._build_label_ancestry(label_id)
+        rule = self._get_auto_rule(label_id)
+        if rule:
+          rules.append(rule)
 
+      self._matcher = AutoMatcher(rules)
+      log.debug("[%s] Auto-label matcher built for %s labels",
+          PLUGIN_NAME, len(rules))
 
-  def _build_label_ancestry(self, label_id):
+    return self._matcher
 
-    members = []
-    member = label_id
-    while member and member != NULL_PARENT:
-      ancestry_str = self._index[member].get("ancestry")
-      if ancestry_str:
-        members.append(ancestry_str)
 
-        break
+  def _get_status_snapshot(self, torrent_id):
 
-      members.append(self._labels[member]["name"])
-      member = Label.get_parent(member)
+    torrent = self._torrents[torrent_id]
 
-    ancestry_str = "/".join(reversed(members))
-    self._index[label_id]["ancestry"] = ancestry_str
+    status = self._status_cache.get(torrent_id)
+    if status is None:
+      status = torrent.get_status(["name", "save_path"])
+      status["tracker_list"] = None
+      self._status_cache[torrent_id] = status
 
-    return ancestry_str
+    # Deluge replaces the tracker list object whenever trackers are changed
+    if status["tracker_list"] is not torrent.trackers:
+      status["tracker_list"] = torrent.trackers
+      status["trackers"] = tuple(t["url"] for t in torrent.trackers)
 
+    return status
 
-  def _clear_subtree_ancestry(self, parent_id):
 
-    if self._index[parent_id].get("ancestry") is not None:
-      del self._index[parent_id]["ancestry"]
+  def _get_match_snapshot(self, matcher, torrent_id):
 
-    for id in self._index[parent_id]["children"]:
-      self._clear_subtree_ancestry(id)
+    status = self._get_status_snapshot(torrent_id)
 
+    trackers = ()
+    if matcher.uses_trackers:
+      trackers = status["trackers"]
 
-  def _has_auto_apply_match(self, label_id, torrent_id):
+    return (torrent_id, status["name"], trackers)
 
-    name = self._torrents[torrent_id].get_status(["name"])["name"]
-    trackers = tuple(t["url"] for t in self._torrents[torrent_id].trackers)
 
-    options = self._labels[label_id]["data"]
-    for line in options["auto_queries"]:
-      terms = line.split()
+  def _match_torrent(self, matcher, torrent_id):
 
-      if options["auto_name"]:
-        if all(t in name for t in terms):
-          return True
-      elif options["auto_tracker"]:
-        for tracker in trackers:
-          if all(t in tracker for t in terms):
-            return True
+    torrent_id, name, trackers = self._get_match_snapshot(matcher, torrent_id)
 
-    return False
+    return matcher.match(name, trackers)
+
+
+  def _start_match_job(self, matcher, unlabeled_only, label_id=None):
+
+    # Only the latest rules are applied; an older pass would be overwritten
+    self._cancel_jobs(label_id)
+
+    if unlabeled_only:
+      torrents = [t for t in self._torrents if t not in self._mappings]
+    else:
+      torrents = self._torrents.keys()
+
+
+    def is_candidate(torrent_id):
+
+      if torrent_id not in self._torrents:
+        return False
+
+      return not unlabeled_only or torrent_id not in self._mappings
+
+
+    def process(torrent_id):
+
+      if is_candidate(torrent_id):
+        return self._match_torrent(matcher, torrent_id)
+
+
+    def prepare(torrent_id):
+
+      if is_candidate(torrent_id):
+        return self._get_match_snapshot(matcher, torrent_id)
+
+
+    def finish(job):
+
+      matches = {}
+      for torrent_id, id in job.results:
+        if id in self._labels:
+          if not unlabeled_only or torrent_id not in self._mappings:
+            matches.setdefault(id, []).append(torrent_id)
+
+      for id, torrent_list in matches.iteritems():
+        self.set_torrent_labels(id, torrent_list)
+
+      self._save_config()
+
+
+    info = {"label_id": label_id}
+    processes = self._prefs["options"]["rescan_processes"]
+
+    if processes > 1 and matcher:
+      # The pool gets plain snapshots, torrents can't leave the main process
+      job = PoolJob(self._next_job_id, torrents, prepare, match_torrents,
+          matcher, finish, processes, JOB_CHUNK_SIZE, info=info)
+    else:
+      job = ChunkedJob(self._next_job_id, torrents, process, finish,
+          JOB_CHUNK_SIZE, info=info)
+
+    self._next_job_id += 1
+
+    # Keep the status of recent jobs around for clients to query
+    finished = [id for id, x in self._jobs.iteritems() if not x.running]
+    for id in finished[:max(0, len(finished)-MAX_FINISHED_JOBS)]:
+      del self._jobs[id]
+
+    self._jobs[job.id] = job
+    job.start()
+
+    log.debug("[%s] Auto-label job %s started for %s on %s torrents",
+        PLUGIN_NAME, job.id, label_id or "all labels", job.total)
+
+    return job.id
+
+
+  def _cancel_jobs(self, label_id):
+
+    for job in self._jobs.itervalues():
+      if job.running and job.info["label_id"] == label_id:
+        job.cancel()
 
 
   def _normalize_options(self, options):
@@ -752,6 +1415,14 @@ class Core(CorePluginBase):
       if key not in options:
         options[key] = OPTION_DEFAULTS[key]
 
+    if options["storage_backend"] not in BACKENDS:
+      options["storage_backend"] = OPTION_DEFAULTS["storage_backend"]
+
+    try:
+      options["rescan_processes"] = max(1, int(options["rescan_processes"]))
+    except (TypeError, ValueError):
+      options["rescan_processes"] = OPTION_DEFAULTS["rescan_processes"]
+
 
   def _normalize_label_data(self, data):
 
@@ -772,103 +1443,136 @@ class Core(CorePluginBase):
         data[key] = LABEL_DEFAULTS[key]
 
 
-  def _apply_torrent_options(self, torrent_id, reset=False):
+  def _get_option_vector(self, label_id):
 
-    label_id = self._mappings.get(torrent_id)
+    # The torrent settings a label calls for, as (setter, value) pairs in the
+    # order they are applied; label_id None gives the core defaults
 
-    options = self._labels[label_id]["data"]
-    torrent = self._torrents[torrent_id]
+    options = self._labels[label_id]["data"] if label_id else None
+    core = self._core
 
-    if not reset and options["download_settings"]:
+    if options and options["download_settings"]:
       if options["move_data_completed"]:
-        torrent.set_move_completed(options["move_data_completed"])
-        torrent.set_move_completed_path(options["move_data_completed_path"])
+        move = [
+          ("set_move_completed", options["move_data_completed"]),
+          ("set_move_completed_path", options["move_data_completed_path"]),
+        ]
       else:
-        torrent.set_move_completed(self._core["move_completed"])
-        torrent.set_move_completed_path(self._core["move_completed_path"])
-
-      torrent.set_options({
-        "prioritize_first_last_pieces": options["prioritize_first_last"],
-      })
+        move = [
+          ("set_move_completed", core["move_completed"]),
+          ("set_move_completed_path", core["move_completed_path"]),
+        ]
+
+      vector = move + [
+        ("set_options", {
+          "prioritize_first_last_pieces": options["prioritize_first_last"],
+        }),
+      ]
     else:
-      torrent.set_move_completed(self._core["move_completed"])
-      torrent.set_move_completed_path(self._core["move_completed_path"])
-      torrent.set_options({
-        "prioritize_first_last_pieces":
-          self._core["prioritize_first_last_pieces"],
-      })
-
-    if not reset and options["bandwidth_settings"]:
-      torrent.set_max_download_speed(options["max_download_speed"])
-      torrent.set_max_upload_speed(options["max_upload_speed"])
-      torrent.set_max_connections(options["max_connections"])
-      torrent.set_max_upload_slots(options["max_upload_slots"])
+      vector = [
+        ("set_move_completed", core["move_completed"]),
+        ("set_move_completed_path", core["move_completed_path"]),
+        ("set_options", {
+          "prioritize_first_last_pieces":
+            core["prioritize_first_last_pieces"],
+        }),
+      ]
+
+    if options and options["bandwidth_settings"]:
+      vector += [
+        ("set_max_download_speed", options["max_download_speed"]),
+        ("set_max_upload_speed", options["max_upload_speed"]),
+        ("set_max_connections", options["max_connections"]),
+        ("set_max_upload_slots", options["max_upload_slots"]),
+      ]
     else:
-      torrent.set_max_download_speed(
-          self._core["max_download_speed_per_torrent"])
-      torrent.set_max_upload_speed(self._core["max_upload_speed_per_torrent"])
-      torrent.set_max_connections(self._core["max_connections_per_torrent"])
-      torrent.set_max_upload_slots(self._core["max_upload_slots_per_torrent"])
-
-    if not reset and options["queue_settings"]:
-      torrent.set_auto_managed(options["auto_managed"])
-      torrent.set_stop_at_ratio(options["stop_at_ratio"])
-      torrent.set_stop_ratio(options["stop_ratio"])
-      torrent.set_remove_at_ratio(options["remove_at_ratio"])
+      vector += [
+        ("set_max_download_speed", core["max_download_speed_per_torrent"]),
+        ("set_max_upload_speed", core["max_upload_speed_per_torrent"]),
+        ("set_max_connections", core["max_connections_per_torrent"]),
+        ("set_max_upload_slots", core["max_upload_slots_per_torrent"]),
+      ]
+
+    if options and options["queue_settings"]:
+      vector += [
+        ("set_auto_managed", options["auto_managed"]),
+        ("set_stop_at_ratio", options["stop_at_ratio"]),
+        ("set_stop_ratio", options["stop_ratio"]),
+        ("set_remove_at_ratio", options["remove_at_ratio"]),
+      ]
     else:
-      torrent.set_auto_managed(self._core["auto_managed"])
-      torrent.set_stop_at_ratio(self._core["stop_seed_at_ratio"])
-      torrent.set_stop_ratio(self._core["stop_seed_ratio"])
-      torrent.set_remove_at_ratio(self._core["remove_seed_at_ratio"])
+      vector += [
+        ("set_auto_managed", core["auto_managed"]),
+        ("set_stop_at_ratio", core["stop_seed_at_ratio"]),
+        ("set_stop_ratio", core["stop_seed_ratio"]),
+        ("set_remove_at_ratio", core["remove_seed_at_ratio"]),
+      ]
 
+    return vector
 
-  def _apply_data_completed_path(self, label_id):
 
-    for id in self._index[label_id]["torrents"]:
-      self._torrents[id].set_move_completed_path(
-          self._labels[label_id]["data"]["move_data_completed_path"])
+  def _apply_torrent_options(self, torrent_id, vector):
 
+    # Only setters whose value differs from the one last applied are called
+    torrent = self._torrents[torrent_id]
+    applied = self._applied.setdefault(torrent_id, {})
 
-  def _propagate_path_to_descendents(self, parent_id):
+    count = 0
+    for setter, value in vector:
+      if setter in applied and applied[setter] == value:
+        continue
 
+      getattr(torrent, setter)(value)
+      applied[setter] = value
+      count += 1
 
-    def descend(parent_id):
-      name = self._labels[parent_id]["name"]
-      options = self._labels[parent_id]["data"]
+    self._stats["setters_applied"] += count
+    self._stats["setters_skipped"] += len(vector) - count
 
-      mode = options["move_data_completed_mode"]
-      if mode == "folder": return
 
-      if mode == "subfolder":
-        move_path.append(name)
+  def _apply_data_completed_path(self, label_id):
 
-      options["move_data_completed_path"] = os.path.join(*move_path)
+    vector = [("set_move_completed_path",
+        self._labels[label_id]["data"]["move_data_completed_path"])]
 
-      if options["download_settings"] and options["move_data_completed"]:
-        self._apply_data_completed_path(parent_id)
+    for id in self._index.get_torrents(label_id):
+      self._apply_torrent_options(id, vector)
 
-      for id in self._index[parent_id]["children"]:
-        descend(id)
 
-      if mode == "subfolder":
-        move_path.pop()
+  def _propagate_path_to_descendents(self, parent_id):
 
+    # Pre-order, so each label's parent already has its new path
+    subtree = self._index.get_subtree(parent_id)
 
-    options = self._labels[parent_id]["data"]
-    path = options["move_data_completed_path"]
+    i = 1
+    while i < len(subtree):
+      id = subtree[i]
+      options = self._labels[id]["data"]
 
-    move_path = [path]
+      mode = options["move_data_completed_mode"]
+      if mode == "folder":
+        # Labels with their own folder keep it, and so do their descendants
+        i += self._index.get_subtree_size(id)
+        continue
 
-    for id in self._index[parent_id]["children"]:
-      descend(id)
+      path = self._labels[self._index.get_parent(id)]["data"][
+          "move_data_completed_path"]
+      if mode == "subfolder":
+        path = os.path.join(path, self._labels[id]["name"])
 
+      options["move_data_completed_path"] = path
+      self._label_generations[id] = self._generation
 
-  def _subtree_move_completed(self, parent_id):
+      if options["download_settings"] and options["move_data_completed"]:
+        self._apply_data_completed_path(id)
 
-    self._do_move_completed(parent_id, self._index[parent_id]["torrents"])
+      i += 1
+
+
+  def _subtree_move_completed(self, parent_id):
 
-    for id in self._index[parent_id]["children"]:
-      self._subtree_move_completed(id)
+    for id in self._index.get_subtree(parent_id):
+      self._do_move_completed(id, list(self._index.get_torrents(id)))
 
 
   def _do_move_completed(self, label_id, torrent_list):
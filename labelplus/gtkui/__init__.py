@@ -67,6 +67,11 @@ import dnd
 MAX_RETRIES = 10
 WAIT_TIME = 1.0
 
+DATA_EVENTS = (
+  "LabelPlusLabelsChangedEvent",
+  "LabelPlusCountsChangedEvent",
+)
+
 
 class GtkUI(GtkPluginBase):
 
@@ -80,7 +85,9 @@ class GtkUI(GtkPluginBase):
 
   def enable(self):
 
-    self.timestamp = None
+    self.version = None
+    self.latest_version = None
+    self.update_pending = False
     self.label_data = None
 
     client.labelplus.is_initialized().addCallback(self.cb_check)
@@ -89,7 +96,7 @@ class GtkUI(GtkPluginBase):
   def cb_check(self, result):
 
     if result == True:
-      client.labelplus.get_label_data(self.timestamp).addCallback(
+      client.labelplus.get_label_updates(self.version).addCallback(
         self.cb_data_init)
     elif self.retries < MAX_RETRIES:
       reactor.callLater(WAIT_TIME, self.enable)
@@ -98,12 +105,7 @@ class GtkUI(GtkPluginBase):
 
   def cb_data_init(self, data):
 
-    self.timestamp = data[0]
-    self.label_data = data[1]
-
-    self.label_data[ID_ALL]["name"] = _(ID_ALL)
-    self.label_data[ID_NONE]["name"] = _(ID_NONE)
-
+    self._apply_updates(data)
     self._do_load()
 
 
@@ -127,8 +129,14 @@ class GtkUI(GtkPluginBase):
 
     self.enable_dnd()
 
+    for event in DATA_EVENTS:
+      client.register_event_handler(event, self.on_data_changed)
+
     self.initialized = True
 
+    # Catch changes made before the event handlers were registered
+    self._request_updates()
+
 
   def disable(self):
 
@@ -137,6 +145,9 @@ class GtkUI(GtkPluginBase):
     if self.initialized:
       self.initialized = False
 
+      for event in DATA_EVENTS:
+        client.deregister_event_handler(event, self.on_data_changed)
+
       self._config.save()
       deluge.configmanager.close(self._config)
 
@@ -198,23 +209,77 @@ class GtkUI(GtkPluginBase):
     client.labelplus.get_torrent_label(id).addCallback(self.label_sidebar.select_label)
 
 
-  def update(self):
+  def on_data_changed(self, version):
+
+    self.latest_version = version
+    if self.initialized and version != self.version:
+      self._request_updates()
+
+
+  def _request_updates(self):
+
+    # Only one request in flight; newer events are checked on its return
+    if not self.update_pending:
+      self.update_pending = True
+      client.labelplus.get_label_updates(self.version).addCallbacks(
+        self.cb_update_data, self.cb_update_err)
+
+
+  def cb_update_err(self, failure):
+
+    self.update_pending = False
+    failure.cleanFailure()
 
     if self.initialized:
-      client.labelplus.get_label_data(self.timestamp).addCallback(
-        self.cb_update_data)
+      # Resync everything once the daemon answers again
+      self.version = None
+      reactor.callLater(WAIT_TIME, self._retry_updates)
+
+
+  def _retry_updates(self):
+
+    if self.initialized:
+      self._request_updates()
 
 
   def cb_update_data(self, data):
 
+    self.update_pending = False
+    if not self.initialized:
+      return
+
     if data is not None:
-      self.timestamp = data[0]
-      self.label_data = data[1]
+      full, counts, removed = self._apply_updates(data)
+
+      if full:
+        self.label_sidebar.update_counts(self.label_data)
+      else:
+        self.label_sidebar.update_counts(counts, removed)
+    elif self.latest_version > self.version:
+      # Nothing changed up to the generation the event was sent at
+      self.version = self.latest_version
+
+    if self.latest_version > self.version:
+      self._request_updates()
+
+
+  def _apply_updates(self, data):
+
+    self.version, full, counts, removed = data
+
+    for id in (ID_ALL, ID_NONE):
+      if id in counts:
+        counts[id]["name"] = _(id)
+
+    if full:
+      self.label_data = counts
+    else:
+      self.label_data.update(counts)
 
-      self.label_data[ID_ALL]["name"] = _(ID_ALL)
-      self.label_data[ID_NONE]["name"] = _(ID_NONE)
+      for id in removed:
+        self.label_data.pop(id, None)
 
-      self.label_sidebar.update_counts(self.label_data)
+    return (full, counts, removed)
 
 
   def get_labels(self):
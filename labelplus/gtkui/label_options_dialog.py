@@ -116,6 +116,7 @@ class LabelOptionsDialog(object):
       self.we.chk_auto_settings,
       self.we.rb_auto_name,
       self.we.rb_auto_tracker,
+      self.we.chk_auto_patterns,
     )
 
     self.dependency_widgets = {
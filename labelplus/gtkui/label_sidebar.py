@@ -246,12 +246,17 @@ class LabelSidebar(object):
     self.menu.show_all()
 
 
-  def update_counts(self, counts):
+  def update_counts(self, counts, removed=None):
 
     self.sorted_store.set_sort_column_id(-1, gtk.SORT_ASCENDING)
     self.label_tree.freeze_child_notify()
 
-    self._remove_invalid_labels(counts)
+    # Without an explicit removal list, counts holds every label
+    if removed is None:
+      removed = [id for id in self.row_map
+          if id not in counts and id != NULL_PARENT]
+
+    self._remove_labels(removed)
 
     for id in sorted(counts):
       if id == NULL_PARENT: continue
@@ -513,17 +518,13 @@ class LabelSidebar(object):
     return self.store.get_value(self.row_map[id], 1)
 
 
-  def _remove_invalid_labels(self, counts):
-
-    removals = []
-    for id in self.row_map:
-      if id not in counts and id != NULL_PARENT:
-        removals.append(id)
+  def _remove_labels(self, label_ids):
 
-    for id in sorted(removals, reverse=True):
-      row = self.row_map[id]
-      self.store.remove(row)
-      del self.row_map[id]
+    for id in sorted(label_ids, reverse=True):
+      row = self.row_map.get(id)
+      if row:
+        self.store.remove(row)
+        del self.row_map[id]
 
 
   def _load_tree_state(self):
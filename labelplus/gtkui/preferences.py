@@ -106,6 +106,7 @@ class Preferences(object):
       self.we.chk_auto_settings,
       self.we.rb_auto_name,
       self.we.rb_auto_tracker,
+      self.we.chk_auto_patterns,
     )
 
     self.rgrp_move_data_completed = (
@@ -251,6 +252,10 @@ class Preferences(object):
 
     options = dict(OPTION_DEFAULTS)
 
+    # Keep daemon-side options that have no widgets on this page
+    if self.last_prefs:
+      options.update(self.last_prefs["options"])
+
     for widget in self.general_widgets:
       prefix, sep, name = widget.get_name().partition("_")
       if sep and name in options: